@@ -7,6 +7,22 @@ Este arquivo é o ponto de entrada do plugin. O QGIS chama a função
 classFactory automaticamente quando o plugin é carregado.
 """
 
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _get_plugin_cls():
+    """
+    Importa a classe principal do plugin uma única vez.
+    
+    Chamadas seguintes de classFactory reutilizam a classe já resolvida,
+    sem passar novamente pelo mecanismo de importação.
+    """
+    # O ponto antes do nome indica importação relativa (mesmo diretório)
+    from .spatial_analysis import SpatialAnalysisPlugin
+    return SpatialAnalysisPlugin
+
+
 def classFactory(iface):
     """
     Função obrigatória chamada pelo QGIS para carregar o plugin.
@@ -22,9 +38,5 @@ def classFactory(iface):
     Returns:
         Instância da classe principal do plugin
     """
-    # Importar a classe principal do plugin
-    # O ponto antes do nome indica importação relativa (mesmo diretório)
-    from .spatial_analysis import SpatialAnalysisPlugin
-    
     # Retornar uma instância do plugin, passando a interface do QGIS
-    return SpatialAnalysisPlugin(iface)
\ No newline at end of file
+    return _get_plugin_cls()(iface)
\ No newline at end of file
@@ -9,23 +9,182 @@ import sys
 import subprocess
 import os
 import platform
+import glob
+import io
+import re
+import contextlib
+import shutil
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+try:
+    from importlib.metadata import distribution, PackageNotFoundError
+except ImportError:  # Python < 3.8
+    distribution = None
+
+# Sistema operacional e interpretador não mudam durante a execução
+_SYSTEM = platform.system()
+_PY = sys.executable
+
+if _SYSTEM == "Windows":
+    import ctypes
+
+def _find_pip():
+    """
+    Localiza o executável do pip do interpretador atual.
+    
+    Procura apenas o script com a versão do interpretador (por exemplo,
+    pip3.11) no diretório do interpretador (e 'Scripts' no Windows): um
+    'pip' sem versão em diretórios compartilhados como /usr/bin pertence ao
+    Python padrão do sistema, não necessariamente a este. Sem ele, recorre
+    a 'python -m pip', que falha com uma mensagem clara se este
+    interpretador não tiver pip.
+    """
+    interpreter_dir = os.path.dirname(_PY)
+    search_path = os.pathsep.join([interpreter_dir, os.path.join(interpreter_dir, "Scripts")])
+    pip_name = "pip{}.{}".format(*sys.version_info[:2])
+    pip_path = shutil.which(pip_name, path=search_path)
+    return [pip_path] if pip_path else [_PY, "-m", "pip"]
+
+_PIP = _find_pip()
+
+# Lista de dependências necessárias
+REQUIRED_PACKAGES = ["numpy", "scipy"]
+
+# Nome de importação -> nome da distribuição no PyPI (podem diferir)
+_DISTRIBUTION_NAMES = {"numpy": "numpy", "scipy": "scipy"}
+
+# Versões fixas com wheels para Python 3.9 a 3.12 (QGIS 3.22 a 3.40):
+# o resolvedor do pip busca um único conjunto de metadados por pacote,
+# sem retrocessos. Fora dessa faixa o pip escolhe as versões livremente.
+_PINNED_VERSIONS = {"numpy": "1.26.4", "scipy": "1.13.1"}
+_USE_PINS = (3, 9) <= sys.version_info[:2] <= (3, 12)
+
+def _requirement(package_name):
+    """Retorna a especificação passada ao pip para o pacote"""
+    version = _PINNED_VERSIONS.get(package_name)
+    if _USE_PINS and version:
+        return f"{_DISTRIBUTION_NAMES.get(package_name, package_name)}=={version}"
+    return _DISTRIBUTION_NAMES.get(package_name, package_name)
+
+def _wait(prompt):
+    """
+    Aguarda o usuário pressionar Enter, exceto em execuções automatizadas.
+    
+    Retorna imediatamente se SPATIAL_ANALYSIS_UNATTENDED estiver definida
+    ou se não houver terminal interativo (CI, scripts de provisionamento).
+    """
+    if (os.environ.get("SPATIAL_ANALYSIS_UNATTENDED")
+            or sys.stdin is None or not sys.stdin.isatty()):
+        return
+    input(prompt)
+
+@lru_cache(maxsize=1)
 def check_admin():
     """Verifica se o script está sendo executado como administrador"""
     try:
-        if platform.system() == "Windows":
-            import ctypes
+        if _SYSTEM == "Windows":
             return ctypes.windll.shell32.IsUserAnAdmin()
         else:
             return os.geteuid() == 0
     except Exception:
         return False
 
+# Sem checagem de nova versão do pip (uma requisição HTTPS a menos),
+# sem prompts interativos e sem barra de progresso
+_PIP_FLAGS = ["--disable-pip-version-check", "--no-input", "-q"]
+
+@lru_cache(maxsize=1)
+def _load_pip_main():
+    """
+    Importa o ponto de entrada interno do pip apenas quando uma instalação
+    é realmente necessária: a importação custa a maior parte do tempo de
+    carga do script e não deve pesar no caminho rápido.
+    """
+    try:
+        from pip._internal.cli.main import main
+    except ImportError:
+        return None
+    return main
+
+def _pip(args):
+    """
+    Executa o pip com os argumentos informados.
+    
+    Na thread principal o pip roda no próprio processo, evitando iniciar um
+    novo interpretador a cada instalação. Nas instalações paralelas (ou se
+    o pip interno não puder ser importado) usa um subprocesso, pois o pip
+    não é seguro para uso simultâneo no mesmo processo.
+    
+    Returns:
+        Tupla (código de retorno, saída capturada)
+    """
+    if threading.current_thread() is threading.main_thread():
+        pip_main = _load_pip_main()
+        if pip_main is not None:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                returncode = pip_main(list(args))
+            return returncode, output.getvalue()
+    
+    proc = subprocess.run([*_PIP, *args], stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.returncode, proc.stdout
+
+# Mensagens do pip quando nenhuma distribuição atende ao requisito: com
+# --only-binary, indicam que não há wheel para esta plataforma
+_NO_DISTRIBUTION_MARKERS = ("No matching distribution found",
+                            "Could not find a version that satisfies the requirement")
+
+def _no_distribution(output):
+    """Indica se a falha do pip foi por não encontrar distribuição compatível"""
+    return any(marker in output for marker in _NO_DISTRIBUTION_MARKERS)
+
+def _unavailable_requirements(output):
+    """Requisitos que o pip não encontrou nem como wheel nem como código-fonte"""
+    return set(re.findall(r"No matching distribution found for (\S+)", output))
+
+@lru_cache(maxsize=1)
+def _warn_source_build():
+    """Avisa (uma única vez por execução) sobre a compilação a partir do código-fonte"""
+    print("⚠️  Nenhum pacote pré-compilado (wheel) disponível para esta plataforma.")
+    print("   Tentando compilar a partir do código-fonte, o que exige")
+    print("   compiladores C/Fortran instalados e pode demorar vários minutos...")
+
+def _run_pip_install(packages):
+    """
+    Executa 'pip install' capturando a saída, que só é exibida em caso de falha.
+    
+    Raises:
+        subprocess.CalledProcessError: se o pip terminar com erro
+    """
+    args = ["install", *_PIP_FLAGS, *(_requirement(p) for p in packages)]
+    
+    # Somente wheels: evita compilar numpy/scipy a partir do código-fonte,
+    # o que exige compiladores C/Fortran raramente presentes no QGIS
+    returncode, output = _pip(args + ["--only-binary=:all:"])
+    if returncode == 0:
+        return
+    
+    # Outras falhas (rede, permissões, conflitos) não se resolvem compilando:
+    # exibe o erro real uma única vez
+    if _no_distribution(output):
+        _warn_source_build()
+        returncode, output = _pip(args)
+        if returncode == 0:
+            return
+    
+    if output:
+        print(output)
+    raise subprocess.CalledProcessError(returncode, ["pip", *args], output)
+
 def install_package(package_name):
     """Instala um pacote Python usando pip"""
     try:
         print(f"Instalando {package_name}...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package_name])
+        _run_pip_install([package_name])
         print(f"✓ {package_name} instalado com sucesso!")
         return True
     except subprocess.CalledProcessError as e:
@@ -35,32 +194,113 @@ def install_package(package_name):
         print(f"✗ Erro inesperado ao instalar {package_name}: {e}")
         return False
 
-def check_package(package_name):
-    """Verifica se um pacote está instalado"""
+def install_packages(packages):
+    """
+    Instala vários pacotes em uma única chamada ao pip.
+    
+    Uma só execução paga o custo de inicialização do pip uma vez e deixa
+    o resolvedor ver o conjunto completo (numpy é dependência do scipy).
+    Se a instalação em lote falhar, tenta pacote por pacote, exceto os que
+    o pip já informou não existirem no índice.
+    
+    Returns:
+        Lista com os pacotes instalados com sucesso
+    """
     try:
-        __import__(package_name)
-        print(f"✓ {package_name} já está instalado")
-        return True
-    except ImportError:
-        print(f"✗ {package_name} não encontrado")
-        return False
+        print(f"Instalando {', '.join(packages)}...")
+        _run_pip_install(packages)
+        for package in packages:
+            print(f"✓ {package} instalado com sucesso!")
+        return list(packages)
+    except subprocess.CalledProcessError as e:
+        print(f"✗ Erro na instalação em lote: {e}")
+        unavailable = _unavailable_requirements(e.output or "")
+    except Exception as e:
+        print(f"✗ Erro inesperado na instalação em lote: {e}")
+        unavailable = set()
+    
+    remaining = []
+    for package in packages:
+        if _requirement(package) in unavailable:
+            print(f"✗ {package} não foi encontrado no índice de pacotes")
+        else:
+            remaining.append(package)
+    
+    if remaining:
+        print("Tentando instalar um pacote por vez...\n")
+    return [package for package in remaining if install_package(package)]
 
-def detect_qgis_python():
-    """Tenta detectar o interpretador Python do QGIS"""
-    system = platform.system()
+def install_packages_parallel(packages, max_workers=4):
+    """
+    Instala pacotes em processos pip simultâneos (um por pacote).
+    
+    Útil quando a lista de dependências cresce: os downloads independentes
+    se sobrepõem. Os subprocessos liberam o GIL, então threads bastam.
+    
+    Returns:
+        Lista com os pacotes instalados com sucesso
+    """
+    workers = min(max_workers, len(packages))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(install_package, packages))
+    return [package for package, ok in zip(packages, results) if ok]
+
+@lru_cache(maxsize=None)
+def _package_present(package_name):
+    """Localiza o pacote sem importá-lo (evita carregar numpy/scipy inteiros)"""
+    if distribution is not None:
+        # Lê apenas os metadados instalados em site-packages
+        try:
+            distribution(_DISTRIBUTION_NAMES.get(package_name, package_name))
+            return True
+        except PackageNotFoundError:
+            pass
+    return importlib.util.find_spec(package_name) is not None
+
+def _invalidate(package_name):
+    """
+    Descarta o resultado em cache da verificação de um pacote.
+    
+    O lru_cache não remove chaves isoladas, então o cache inteiro é limpo;
+    as demais consultas são baratas de refazer. Também invalida os caches
+    de busca do importlib para enxergar pacotes recém-instalados.
+    """
+    importlib.invalidate_caches()
+    _package_present.cache_clear()
+
+def _version_key(path):
+    """Números do caminho (versões do QGIS e do Python) para ordenação"""
+    return tuple(int(number) for number in re.findall(r"\d+", path))
+
+def _build_candidate_paths(system):
+    """
+    Monta os caminhos possíveis do Python do QGIS para o sistema informado.
     
+    Returns:
+        Tupla (caminhos já encontrados pelo glob, caminhos fixos a verificar)
+    """
+    found_paths = []
     possible_paths = []
     
     if system == "Windows":
-        # Caminhos comuns para instalações do QGIS no Windows
-        qgis_versions = ["3.34", "3.32", "3.30", "3.28"]
-        for version in qgis_versions:
-            possible_paths.extend([
-                f"C:\\Program Files\\QGIS {version}\\apps\\Python39\\python.exe",
-                f"C:\\Program Files\\QGIS {version}\\apps\\Python38\\python.exe",
-                f"C:\\OSGeo4W64\\apps\\Python39\\python.exe",
-                f"C:\\OSGeo4W\\apps\\Python39\\python.exe",
-            ])
+        # Uma listagem de "Program Files" encontra todas as versões do QGIS
+        # instaladas (inclusive futuras), em vez de testar versão por versão;
+        # a listagem vem em ordem alfabética, então as versões mais novas
+        # são colocadas primeiro
+        qgis_paths = []
+        try:
+            for entry in os.scandir("C:\\Program Files"):
+                if entry.is_dir() and entry.name.startswith("QGIS "):
+                    qgis_paths.extend(glob.glob(
+                        os.path.join(entry.path, "apps", "Python3*", "python.exe")))
+        except (FileNotFoundError, PermissionError):
+            pass
+        found_paths.extend(sorted(qgis_paths, key=_version_key, reverse=True))
+        
+        for osgeo_root in ("C:\\OSGeo4W64", "C:\\OSGeo4W"):
+            found_paths.extend(sorted(glob.glob(
+                os.path.join(osgeo_root, "apps", "Python3*", "python.exe")),
+                key=_version_key, reverse=True))
     
     elif system == "Darwin":  # macOS
         possible_paths.extend([
@@ -74,93 +314,149 @@ def detect_qgis_python():
             "/usr/local/bin/python3",
         ])
     
-    # Verificar qual caminho existe
-    for path in possible_paths:
-        if os.path.exists(path):
-            print(f"Python do QGIS encontrado em: {path}")
-            return path
+    return tuple(found_paths), tuple(possible_paths)
+
+@lru_cache(maxsize=1)
+def detect_qgis_python():
+    """Tenta detectar o interpretador Python do QGIS"""
+    # Caminhos montados apenas aqui (e uma única vez, pelo cache): o caminho
+    # rápido do instalador não paga as listagens de diretórios
+    found_paths, possible_paths = _build_candidate_paths(_SYSTEM)
+    
+    # Caminhos vindos do glob já existem e não precisam de nova verificação
+    path = found_paths[0] if found_paths else None
+    
+    # Candidatos fixos: uma listagem só compensa quando um diretório pai
+    # agrupa vários deles; com um único candidato, os.path.exists é muito
+    # mais barato que listar diretórios grandes como /usr/bin (e também
+    # rejeita links simbólicos quebrados)
+    if path is None:
+        by_parent = {}
+        for p in possible_paths:
+            by_parent.setdefault(os.path.dirname(p), []).append(p)
+        
+        existing = set()
+        for parent, paths in by_parent.items():
+            if len(paths) == 1:
+                existing.update(p for p in paths if os.path.exists(p))
+                continue
+            try:
+                with os.scandir(parent) as entries:
+                    names = {entry.name for entry in entries}
+            except OSError:
+                continue
+            existing.update(p for p in paths
+                            if os.path.basename(p) in names and os.path.exists(p))
+        
+        path = next((p for p in possible_paths if p in existing), None)
+    if path is not None:
+        print(f"Python do QGIS encontrado em: {path}")
+        return path
     
     print("Python do QGIS não encontrado automaticamente.")
-    print("Usando o interpretador Python atual:", sys.executable)
-    return sys.executable
+    print("Usando o interpretador Python atual:", _PY)
+    return _PY
+
+def _flush(log):
+    """Escreve de uma só vez no terminal o texto acumulado de uma fase"""
+    sys.stdout.write(log.getvalue())
+    sys.stdout.flush()
 
 def main():
     """Função principal do instalador"""
-    print("=" * 60)
-    print("INSTALADOR DE DEPENDÊNCIAS")
-    print("Plugin de Análise de Autocorrelação Espacial para QGIS")
-    print("=" * 60)
+    # A saída de cada fase é acumulada e escrita no terminal de uma vez
+    log = io.StringIO()
+    print("=" * 60, file=log)
+    print("INSTALADOR DE DEPENDÊNCIAS", file=log)
+    print("Plugin de Análise de Autocorrelação Espacial para QGIS", file=log)
+    print("=" * 60, file=log)
+    
+    # Caminho rápido: em reexecuções tudo já está instalado e não há
+    # necessidade de detectar o Python do QGIS nem de checar permissões
+    if all(_package_present(package) for package in REQUIRED_PACKAGES):
+        print("\n🎉 Todas as dependências já estão instaladas!", file=log)
+        print("\nVocê pode ativar o plugin no QGIS agora.", file=log)
+        _flush(log)
+        _wait("\nPressione Enter para sair...")
+        return
     
     # Verificar sistema operacional
-    system = platform.system()
-    print(f"Sistema operacional detectado: {system}")
-    print(f"Interpretador Python atual: {sys.executable}")
+    system = _SYSTEM
+    print(f"Sistema operacional detectado: {system}", file=log)
+    print(f"Interpretador Python atual: {_PY}", file=log)
     
     # Verificar permissões de administrador no Windows
     if system == "Windows" and not check_admin():
-        print("\n⚠️  AVISO: Para melhor compatibilidade, execute este script como Administrador")
-        print("   Clique com botão direito no arquivo e selecione 'Executar como administrador'")
-        input("\nPressione Enter para continuar mesmo assim...")
+        print("\n⚠️  AVISO: Para melhor compatibilidade, execute este script como Administrador", file=log)
+        print("   Clique com botão direito no arquivo e selecione 'Executar como administrador'", file=log)
+        _flush(log)
+        log = io.StringIO()
+        _wait("\nPressione Enter para continuar mesmo assim...")
+    _flush(log)
     
     # Detectar Python do QGIS
     qgis_python = detect_qgis_python()
     
-    print("\n" + "-" * 40)
-    print("VERIFICANDO DEPENDÊNCIAS EXISTENTES")
-    print("-" * 40)
+    log = io.StringIO()
+    print("\n" + "-" * 40, file=log)
+    print("VERIFICANDO DEPENDÊNCIAS EXISTENTES", file=log)
+    print("-" * 40, file=log)
     
-    # Lista de dependências necessárias
-    required_packages = ["numpy", "scipy"]
+    # Verificar quais pacotes já estão instalados (resumo em uma só linha)
+    status = {package: _package_present(package) for package in REQUIRED_PACKAGES}
+    print("Dependências: " + ", ".join(
+        f"{package} {'✓' if ok else '✗'}" for package, ok in status.items()), file=log)
     
-    # Verificar quais pacotes já estão instalados
-    installed = []
-    missing = []
-    
-    for package in required_packages:
-        if check_package(package):
-            installed.append(package)
-        else:
-            missing.append(package)
+    missing = [package for package, ok in status.items() if not ok]
     
     if not missing:
-        print("\n🎉 Todas as dependências já estão instaladas!")
-        print("\nVocê pode ativar o plugin no QGIS agora.")
-        input("\nPressione Enter para sair...")
+        print("\n🎉 Todas as dependências já estão instaladas!", file=log)
+        print("\nVocê pode ativar o plugin no QGIS agora.", file=log)
+        _flush(log)
+        _wait("\nPressione Enter para sair...")
         return
     
-    print("\n" + "-" * 40)
-    print("INSTALANDO DEPENDÊNCIAS AUSENTES")
-    print("-" * 40)
+    print("\n" + "-" * 40, file=log)
+    print("INSTALANDO DEPENDÊNCIAS AUSENTES", file=log)
+    print("-" * 40, file=log)
+    _flush(log)
     
-    success_count = 0
+    # Instalação paralela é opcional: o cache do pip é compartilhado entre
+    # os processos, então o padrão continua sendo a instalação em lote
+    if os.environ.get("PIP_PARALLEL") == "1" and len(missing) > 1:
+        success_count = len(install_packages_parallel(missing))
+    else:
+        success_count = len(install_packages(missing))
     
+    # Confirmar que os pacotes recém-instalados são realmente encontrados
     for package in missing:
-        if install_package(package):
-            success_count += 1
-        print()  # Linha em branco para separar
+        _invalidate(package)
+    success_count = min(success_count, sum(_package_present(p) for p in missing))
     
-    print("\n" + "=" * 60)
-    print("RESUMO DA INSTALAÇÃO")
-    print("=" * 60)
+    log = io.StringIO()
+    print("\n" + "=" * 60, file=log)
+    print("RESUMO DA INSTALAÇÃO", file=log)
+    print("=" * 60, file=log)
     
     if success_count == len(missing):
-        print("🎉 Todas as dependências foram instaladas com sucesso!")
-        print("\nPróximos passos:")
-        print("1. Reinicie o QGIS")
-        print("2. Vá para 'Complementos > Gerenciar e Instalar Complementos'")
-        print("3. Na aba 'Instalados', encontre e ative o plugin")
-        print("4. O plugin aparecerá no menu 'Vetor > Análise Espacial'")
+        print("🎉 Todas as dependências foram instaladas com sucesso!", file=log)
+        print("\nPróximos passos:", file=log)
+        print("1. Reinicie o QGIS", file=log)
+        print("2. Vá para 'Complementos > Gerenciar e Instalar Complementos'", file=log)
+        print("3. Na aba 'Instalados', encontre e ative o plugin", file=log)
+        print("4. O plugin aparecerá no menu 'Vetor > Análise Espacial'", file=log)
     else:
-        print(f"⚠️  Apenas {success_count} de {len(missing)} dependências foram instaladas.")
-        print("\nSe houver problemas, tente:")
-        print("1. Execute este script como Administrador (Windows)")
-        print("2. Instale manualmente usando:")
+        print(f"⚠️  Apenas {success_count} de {len(missing)} dependências foram instaladas.", file=log)
+        print("\nSe houver problemas, tente:", file=log)
+        print("1. Execute este script como Administrador (Windows)", file=log)
+        print("2. Instale manualmente usando:", file=log)
         for package in missing:
-            print(f"   pip install {package}")
-        print("3. Consulte o README.md para instruções detalhadas")
+            print(f"   pip install {package}", file=log)
+        print("3. Consulte o README.md para instruções detalhadas", file=log)
     
-    print("\n" + "=" * 60)
-    input("Pressione Enter para sair...")
+    print("\n" + "=" * 60, file=log)
+    _flush(log)
+    _wait("Pressione Enter para sair...")
 
 if __name__ == "__main__":
     try:
@@ -169,4 +465,4 @@ if __name__ == "__main__":
         print("\n\nInstalação interrompida pelo usuário.")
     except Exception as e:
         print(f"\n\nErro inesperado: {e}")
-        input("Pressione Enter para sair...")
\ No newline at end of file
+        _wait("Pressione Enter para sair...")
\ No newline at end of file
@@ -16,19 +16,38 @@ Este plugin oferece:
 - Salvamento de resultados como arquivo permanente (shp)
 """
 
+import hashlib
 import os
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
 
 # Verifica e importa dependências necessárias
 try:
     import numpy as np
     import scipy.spatial.distance as distance
+    from scipy import sparse
     from scipy import stats
-    from scipy.spatial import Delaunay
+    from scipy.spatial import Delaunay, cKDTree
     SCIPY_AVAILABLE = True
 except ImportError:
     SCIPY_AVAILABLE = False
 
+# numexpr é opcional: avalia as transformações dos dados sem temporários
+try:
+    import numexpr as ne
+    NUMEXPR_AVAILABLE = True
+except ImportError:
+    NUMEXPR_AVAILABLE = False
+
+# Numba é opcional: compila os núcleos das permutações quando disponível
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 from qgis.PyQt.QtCore import QVariant, Qt, QTimer
 from qgis.PyQt.QtWidgets import (QAction, QDialog, QVBoxLayout, QHBoxLayout, 
                                 QPushButton, QComboBox, QLabel, QMessageBox, 
@@ -44,7 +63,8 @@ from qgis.core import (QgsProject, QgsVectorLayer, QgsField, QgsFeature,
                        QgsSimpleFillSymbolLayer, QgsRuleBasedRenderer,
                        QgsFillSymbol, QgsColorRamp, QgsGradientColorRamp,
                        QgsGradientStop, QgsSymbolLayer, QgsMarkerSymbol,
-                       QgsMapLayerProxyModel, QgsVectorFileWriter)
+                       QgsMapLayerProxyModel, QgsVectorFileWriter,
+                       QgsSpatialIndex, QgsFeatureRequest)
 
 # Importa Qgis com fallback para compatibilidade
 try:
@@ -92,6 +112,139 @@ def safe_log_message(message, tag="Spatial Analysis", level="info"):
             print(f"[{tag}] {message}")
 
 
+def _to_float(value):
+    """Converte um valor de atributo em float; ausentes ou não numéricos viram NaN"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def permutation_indices(rng, permutations, n):
+    """
+    Gera uma matriz (permutations × n) em que cada linha é uma permutação de 0..n-1.
+    
+    Usa Generator.permuted (NumPy >= 1.20), que embaralha cada linha
+    independentemente em código C; em versões antigas, ordena números aleatórios.
+    """
+    if hasattr(rng, 'permuted'):
+        idx = np.broadcast_to(np.arange(n), (permutations, n)).copy()
+        return rng.permuted(idx, axis=1, out=idx)
+    return np.argsort(rng.random((permutations, n)), axis=1)
+
+
+def conditional_neighbor_ids(rng, permutations, n, k):
+    """
+    Sorteia, para cada permutação, k índices distintos entre as n - 1 demais
+    observações (randomização condicional do LISA, como no PySAL).
+    
+    Com k pequeno em relação a n, sorteia inteiros e resorteia apenas as linhas
+    com repetição: custo O(k) por permutação em vez de embaralhar as n posições.
+    """
+    if k * k > n - 1:
+        return permutation_indices(rng, permutations, n - 1)[:, :k]
+    ids = rng.integers(0, n - 1, size=(permutations, k))
+    while k > 1:
+        ordered = np.sort(ids, axis=1)
+        repeated = np.any(ordered[:, 1:] == ordered[:, :-1], axis=1)
+        if not repeated.any():
+            break
+        ids[repeated] = rng.integers(0, n - 1, size=(int(repeated.sum()), k))
+    return ids
+
+
+def _moran_variance_analytic(W, n):
+    """
+    Variância do I de Moran sob a hipótese de normalidade (Cliff e Ord, 1981).
+    
+    Var[I] = (n²·S1 - n·S2 + 3·S0²) / ((n² - 1)·S0²) - E[I]²
+    
+    Onde S0 = Σᵢⱼ wᵢⱼ, S1 = ½ Σᵢⱼ (wᵢⱼ + wⱼᵢ)² e S2 = Σᵢ (wᵢ. + w.ᵢ)².
+    """
+    S0 = W.sum()
+    S1 = 0.5 * (W + W.T).power(2).sum()
+    S2 = np.square(np.asarray(W.sum(axis=1)).ravel() + np.asarray(W.sum(axis=0)).ravel()).sum()
+    E_I = -1.0 / (n - 1)
+    return (n * n * S1 - n * S2 + 3 * S0 * S0) / ((n * n - 1) * S0 * S0) - E_I * E_I
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _permuted_lags_kernel(y, W_indptr, W_indices, W_data, perm_idx):
+        """
+        Defasagens espaciais das permutações: out[m, i] = Σₖ wᵢₖ · y[perm_idx[m, k]].
+        
+        Percorre as linhas da matriz CSR em código nativo, com as permutações
+        distribuídas entre os núcleos (prange).
+        """
+        M, n = perm_idx.shape
+        out = np.empty((M, n), dtype=y.dtype)
+        for m in prange(M):
+            for i in range(n):
+                acc = 0.0
+                for p in range(W_indptr[i], W_indptr[i + 1]):
+                    acc += W_data[p] * y[perm_idx[m, W_indices[p]]]
+                out[m, i] = acc
+        return out
+    
+    @njit(cache=True)
+    def _splitmix64(state):
+        """Avança o gerador SplitMix64 e retorna (novo estado, número aleatório)"""
+        state = state + np.uint64(0x9E3779B97F4A7C15)
+        z = state
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return state, z ^ (z >> np.uint64(31))
+    
+    @njit(parallel=True, cache=True)
+    def _lisa_perm_kernel(y, W_indptr, W_indices, W_data, lag_obs, lag_center, permutations, seed):
+        """
+        Randomização condicional do LISA, com as observações distribuídas entre
+        os núcleos (prange).
+        
+        Para cada i, sorteia kᵢ vizinhos distintos entre as n - 1 demais
+        observações e acumula os momentos das defasagens permutadas e quantas
+        delas se afastam do centro (lag_center[i]) ao menos tanto quanto a
+        observada. Cada observação tem seu próprio gerador SplitMix64 derivado
+        da semente, o que torna o resultado reproduzível independentemente da
+        distribuição entre threads.
+        """
+        n = len(y)
+        extremes = np.zeros(n)
+        lag_sum = np.zeros(n)
+        lag_sumsq = np.zeros(n)
+        bound = np.uint64(n - 1)
+        for i in prange(n):
+            start = W_indptr[i]
+            k = W_indptr[i + 1] - start
+            ids = np.empty(k, dtype=np.int64)
+            observed = abs(lag_obs[i] - lag_center[i])
+            state = np.uint64(seed) ^ (np.uint64(i + 1) * np.uint64(0xD1B54A32D192ED03))
+            for m in range(permutations):
+                acc = 0.0
+                for t in range(k):
+                    # Sorteio sem reposição: repete enquanto o índice já foi usado
+                    while True:
+                        state, r = _splitmix64(state)
+                        j = np.int64(r % bound)
+                        repeated = False
+                        for u in range(t):
+                            if ids[u] == j:
+                                repeated = True
+                                break
+                        if not repeated:
+                            break
+                    ids[t] = j
+                    if j >= i:
+                        j += 1
+                    acc += W_data[start + t] * y[j]
+                if abs(acc - lag_center[i]) >= observed:
+                    extremes[i] += 1
+                lag_sum[i] += acc
+                lag_sumsq[i] += acc * acc
+        return extremes, lag_sum, lag_sumsq
+
+
 class SpatialAnalysisPlugin:
     """Plugin principal para análise espacial avançada"""
     
@@ -405,6 +558,33 @@ class SpatialAnalysisDialog(QDialog):
 class SpatialAnalysisWorker:
     """Worker simplificado para executar análise espacial"""
     
+    # Matrizes de pesos e KD-trees já construídas, compartilhadas entre
+    # execuções (o diálogo cria um worker novo a cada análise, e é comum
+    # reexecutar ajustando apenas alguns parâmetros)
+    _w_cache = {}
+    _tree_cache = {}
+    _CACHE_SIZE = 8
+    
+    # Acima deste número de observações, os produtos das permutações usam y
+    # centralizado e W em float32: metade dos bytes trafegados nos produtos W·Y,
+    # que são limitados pela memória. Valores, estatísticas observadas e
+    # resultados continuam em float64
+    FLOAT32_THRESHOLD = 5000
+    
+    # Número máximo de elementos (permutações × n) de cada array de
+    # permutações em memória ao mesmo tempo, somando todos os blocos em
+    # andamento (ver _iterate_blocks)
+    PERMUTATION_BLOCK = 2 ** 22
+    
+    # Número máximo de threads por análise. Os blocos de permutações são
+    # sempre dimensionados por este valor, e não pelo número de núcleos da
+    # máquina, para que a mesma semente gere as mesmas permutações em
+    # qualquer computador
+    _MAX_WORKERS = 4
+    
+    # Nomes (em minúsculas) dos campos de identificação copiados para os resultados
+    ID_FIELD_NAMES = frozenset({'id', 'fid', 'objectid'})
+    
     def __init__(self, params):
         self.params = params
         self.current_progress = 0
@@ -428,22 +608,52 @@ class SpatialAnalysisWorker:
         
         # Fase 2: Construção da matriz de pesos espaciais
         self.update_progress(20, "Construindo matriz de pesos espaciais...")
-        W = self.build_spatial_weights_matrix(coordinates)
+        W = self.build_spatial_weights_matrix(coordinates, features)
         
         # Fase 3: Preparação dos dados baseada no tipo
         self.update_progress(35, "Preparando dados para análise...")
         processed_values = self.prepare_data_by_type(values)
         
+        # Validar entradas uma única vez: com valores e pesos finitos e
+        # variância não nula, os testes de permutação não geram NaN/infinito
+        if not np.all(np.isfinite(processed_values)):
+            raise Exception("A transformação dos dados gerou valores inválidos (NaN ou infinito).")
+        if not np.all(np.isfinite(W.data)):
+            raise Exception("A matriz de pesos espaciais contém valores inválidos.")
+        if W.nnz == 0:
+            raise Exception("Nenhuma feição possui vizinhos com o critério de vizinhança selecionado.\n"
+                          "Ajuste os parâmetros (por exemplo, aumente o raio de distância).")
+        if np.ptp(processed_values) == 0:
+            raise Exception("Todos os valores do campo são iguais; não há variação para analisar.")
+        
         # Fase 4: Análises estatísticas
         results = {'original_values': values, 'processed_values': processed_values}
         
+        # Valores centralizados e soma de quadrados calculados uma única vez
+        # e compartilhados por Moran e LISA
+        y = processed_values - processed_values.mean()
+        m2 = np.dot(y, y)
+        
+        # Uma única semente de permutações para Moran e LISA, registrada no
+        # log e no relatório: a análise é reproduzível passando-a de volta em
+        # params['perm_seed']. O Moran usa as mesmas permutações com ou sem
+        # Numba; o LISA com Numba usa outro gerador (SplitMix64 por observação),
+        # então a semente vale para o backend registrado junto com ela
+        self.perm_seed = self.params.get('perm_seed')
+        if self.perm_seed is None:
+            self.perm_seed = int(np.random.SeedSequence().generate_state(1)[0])
+        results['perm_seed'] = self.perm_seed
+        results['perm_backend'] = "Numba" if NUMBA_AVAILABLE else "NumPy"
+        safe_log_message(f"Semente das permutações: {self.perm_seed} (backend {results['perm_backend']})",
+                         "Spatial Analysis", "info")
+        
         if self.params['run_global']:
             self.update_progress(50, "Calculando I de Moran global...")
-            results['moran'] = self.calculate_advanced_moran_i(processed_values, W)
+            results['moran'] = self.calculate_advanced_moran_i(y, m2, W, self.perm_seed)
         
         if self.params['run_lisa']:
             self.update_progress(70, "Calculando indicadores LISA...")
-            results['lisa'] = self.calculate_advanced_lisa(processed_values, W)
+            results['lisa'] = self.calculate_advanced_lisa(processed_values, y, W, self.perm_seed)
             
             # Criar camada com resultados LISA
             self.update_progress(85, "Criando camada de resultados...")
@@ -468,54 +678,63 @@ class SpatialAnalysisWorker:
     
     def extract_and_validate_data(self):
         """Extrai e valida dados da camada vetorial com verificações robustas"""
-        features = []
-        values = []
-        coordinates = []
-        invalid_count = 0
-        
         field_name = self.params['field_name']
         layer = self.params['layer']
         
-        for feature in layer.getFeatures():
+        # Ler do provedor apenas o campo analisado e os campos de identificação
+        # copiados depois para a camada de resultados (create_lisa_layer)
+        fields = layer.fields()
+        field_idx = fields.indexOf(field_name)
+        kept_names = self.ID_FIELD_NAMES | {field_name.lower()}
+        attribute_idx = [i for i, field in enumerate(fields) if field.name().lower() in kept_names]
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes(attribute_idx)
+        
+        # Passada única pela camada: guarda valores brutos e centroides em
+        # arrays pré-alocados; a validação numérica é feita depois, em bloco
+        # featureCount() retorna -1 quando o provedor não conhece a contagem
+        n_hint = max(layer.featureCount(), 0)
+        features = []
+        raw_values = []
+        coordinates = np.empty((n_hint, 2))
+        k = 0
+        invalid_count = 0
+        
+        for feature in layer.getFeatures(request):
             # Verificar geometria válida
             geom = feature.geometry()
             if not geom or geom.isEmpty():
                 invalid_count += 1
                 continue
-                
-            # Verificar valor do campo
-            field_value = feature[field_name]
-            if field_value is None or field_value == '' or str(field_value).lower() in ['null', 'na', 'n/a', 'nan']:
-                invalid_count += 1
-                continue
-                
-            try:
-                value = float(field_value)
-                
-                # Verificar se é um número válido (não infinito, não NaN)
-                if not np.isfinite(value):
-                    invalid_count += 1
-                    continue
-                
-                # Para dados de contagem, verificar se são não-negativos
-                if self.params['data_type'].startswith("Contagem") and value < 0:
-                    invalid_count += 1
-                    continue
-                    
-                values.append(value)
-                features.append(feature)
-                
-                # Obter coordenadas do centroide
-                if geom.type() == QgsWkbTypes.PointGeometry:
-                    point = geom.asPoint()
-                    coordinates.append([point.x(), point.y()])
-                else:
-                    centroid = geom.centroid().asPoint()
-                    coordinates.append([centroid.x(), centroid.y()])
-                    
-            except (ValueError, TypeError):
-                invalid_count += 1
-                continue
+            
+            # Obter coordenadas do centroide
+            if geom.type() == QgsWkbTypes.PointGeometry:
+                point = geom.asPoint()
+            else:
+                point = geom.centroid().asPoint()
+            
+            # featureCount() pode ser uma estimativa em alguns provedores
+            if k == len(coordinates):
+                coordinates = np.resize(coordinates, (2 * k + 1, 2))
+            
+            coordinates[k] = (point.x(), point.y())
+            raw_values.append(feature[field_idx])
+            features.append(feature)
+            k += 1
+        
+        # Conversão e filtragem vetorizadas: valores ausentes ou não numéricos
+        # viram NaN e são descartados junto com infinitos (e negativos, para
+        # dados de contagem) por uma única máscara
+        values = np.fromiter((_to_float(v) for v in raw_values), dtype=float, count=k)
+        valid = np.isfinite(values)
+        if self.params['data_type'].startswith("Contagem"):
+            valid &= values >= 0
+        
+        invalid_count += int(k - valid.sum())
+        features = list(compress(features, valid))
+        values = values[valid]
+        coordinates = coordinates[:k][valid]
+        k = len(values)
         
         # Log de informações sobre dados inválidos
         if invalid_count > 0:
@@ -525,29 +744,52 @@ class SpatialAnalysisWorker:
                 "info"
             )
         
-        if len(values) == 0:
+        if k == 0:
             raise Exception(f"Nenhum valor numérico válido encontrado no campo '{field_name}'.\n"
                           "Verifique se o campo contém dados numéricos válidos.")
         
-        return features, np.array(values), np.array(coordinates)
+        return features, values, coordinates
     
-    def build_spatial_weights_matrix(self, coordinates):
-        """Constrói matriz de pesos espaciais baseada no critério selecionado"""
+    def build_spatial_weights_matrix(self, coordinates, features=None):
+        """
+        Constrói matriz de pesos espaciais baseada no critério selecionado.
+        
+        A matriz é esparsa (CSR): apenas as ligações entre vizinhos são
+        armazenadas, com memória e custo de W @ y proporcionais ao número
+        de vizinhos em vez de n².
+        """
         n = len(coordinates)
-        W = np.zeros((n, n))
+        rows = []
+        cols = []
         
         neighbor_type = self.params['neighbor_type']
         
+        # Chave do cache: coordenadas (hash rápido) + critério e seus parâmetros
+        coords_key = hashlib.blake2b(np.ascontiguousarray(coordinates).tobytes(),
+                                     digest_size=16).digest()
+        w_key = (coords_key, neighbor_type)
+        if "K-vizinhos" in neighbor_type:
+            w_key += (self.params['k_neighbors'],)
+        elif "Distância fixa" in neighbor_type:
+            w_key += (self.params['distance_radius'],)
+        elif "Rook" in neighbor_type:
+            w_key += (self.params['layer'].id(),)
+        
+        if w_key in self._w_cache:
+            return self._w_cache[w_key]
+        
         if "Queen" in neighbor_type:
             # Usar triangulação de Delaunay para definir adjacência Queen
             if n >= 3:  # Mínimo necessário para triangulação
                 try:
                     tri = Delaunay(coordinates)
-                    for simplex in tri.simplices:
-                        for i in range(len(simplex)):
-                            for j in range(i+1, len(simplex)):
-                                W[simplex[i], simplex[j]] = 1
-                                W[simplex[j], simplex[i]] = 1
+                    # Arestas de todos os triângulos de uma vez: cada vértice
+                    # ligado ao seguinte (np.roll fecha o ciclo 0-1, 1-2, 2-0)
+                    simplices = tri.simplices
+                    edges = np.column_stack([simplices.ravel(),
+                                             np.roll(simplices, -1, axis=1).ravel()])
+                    edges = np.unique(np.vstack([edges, edges[:, ::-1]]), axis=0)
+                    rows, cols = edges[:, 0], edges[:, 1]
                 except Exception as e:
                     # Se triangulação falhar, usar K-nearest neighbors como fallback
                     safe_log_message(
@@ -558,234 +800,402 @@ class SpatialAnalysisWorker:
                     # Fallback para K-nearest neighbors
                     k = min(4, n-1)
                     distances = distance.cdist(coordinates, coordinates)
-                    for i in range(n):
-                        nearest = np.argsort(distances[i])[1:k+1]
-                        W[i, nearest] = 1
+                    # argpartition seleciona os k+1 menores de cada linha em
+                    # O(n), sem ordenar a linha inteira; o próprio ponto é
+                    # excluído mascarando a diagonal
+                    np.fill_diagonal(distances, np.inf)
+                    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                    rows = np.repeat(np.arange(n), k)
+                    cols = nearest.ravel()
                         
         elif "Rook" in neighbor_type:
-            # Implementação simplificada de Rook usando distância mínima
-            distances = distance.cdist(coordinates, coordinates)
-            # Encontrar distância mínima não-zero
-            min_dist = np.min(distances[distances > 0])
-            threshold = min_dist * 1.1  # Margem de 10%
-            W = (distances <= threshold) & (distances > 0)
-            W = W.astype(float)
+            # Rook: vizinhos compartilham um trecho de fronteira (não só um vértice)
+            rows, cols = self.find_rook_neighbors(features)
             
         elif "K-vizinhos" in neighbor_type:
-            # K-nearest neighbors
+            # K-nearest neighbors via KD-tree (O(n log n), sem matriz n × n)
             k = min(self.params['k_neighbors'], n-1)
-            distances = distance.cdist(coordinates, coordinates)
-            for i in range(n):
-                nearest = np.argsort(distances[i])[1:k+1]  # Excluir o próprio ponto
-                W[i, nearest] = 1
+            tree = self.get_kdtree(coordinates, coords_key)
+            _, nearest = tree.query(coordinates, k=k+1)
+            nearest = nearest.reshape(n, k+1)[:, 1:]  # Excluir o próprio ponto
+            rows = np.repeat(np.arange(n), k)
+            cols = nearest.ravel()
                 
         elif "Distância fixa" in neighbor_type:
-            # Distância fixa (raio)
+            # Distância fixa (raio): pares dentro do raio encontrados pela KD-tree
             radius = self.params['distance_radius']
-            distances = distance.cdist(coordinates, coordinates)
-            W = (distances <= radius) & (distances > 0)
-            W = W.astype(float)
+            tree = self.get_kdtree(coordinates, coords_key)
+            pairs = tree.query_pairs(radius, output_type='ndarray')
+            rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+            cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        
+        # Montar matriz esparsa binária (ligações repetidas contam uma vez)
+        W = sparse.csr_matrix(
+            (np.ones(len(rows)),
+             (np.asarray(rows, dtype=int), np.asarray(cols, dtype=int))),
+            shape=(n, n)
+        )
+        W.sum_duplicates()
+        W.data[:] = 1.0
         
-        # Normalização linha por linha (row standardization)
-        row_sums = W.sum(axis=1)
-        for i in range(n):
-            if row_sums[i] > 0:
-                W[i] = W[i] / row_sums[i]
+        # Normalização linha por linha (row standardization) como produto
+        # por uma matriz diagonal; linhas sem vizinhos continuam zeradas
+        row_sums = np.asarray(W.sum(axis=1)).ravel()
+        inv = np.divide(1.0, row_sums, out=np.zeros(n), where=row_sums > 0)
+        W = (sparse.diags(inv) @ W).tocsr()
         
+        self._store_in_cache(self._w_cache, w_key, W)
         return W
     
+    def get_kdtree(self, coordinates, coords_key):
+        """Retorna a KD-tree das coordenadas, reaproveitando a de execuções anteriores"""
+        tree = self._tree_cache.get(coords_key)
+        if tree is None:
+            tree = cKDTree(coordinates)
+            self._store_in_cache(self._tree_cache, coords_key, tree)
+        return tree
+    
+    def _store_in_cache(self, cache, key, value):
+        """Guarda um valor no cache, descartando a entrada mais antiga se cheio"""
+        if len(cache) >= self._CACHE_SIZE:
+            del cache[next(iter(cache))]
+        cache[key] = value
+    
+    def find_rook_neighbors(self, features):
+        """
+        Encontra pares de polígonos com fronteira em comum (contiguidade Rook).
+        
+        Um índice espacial limita os testes aos polígonos cujos retângulos
+        envolventes se cruzam; para esses, a interseção precisa ter
+        comprimento (linha compartilhada) - tocar apenas em um ponto é
+        vizinhança Queen, não Rook.
+        """
+        geometries = [feature.geometry() for feature in features or []]
+        if not geometries or any(g.type() != QgsWkbTypes.PolygonGeometry for g in geometries):
+            raise Exception("A vizinhança Rook requer uma camada de polígonos.")
+        
+        # Índice espacial com a posição de cada feição como identificador
+        index = QgsSpatialIndex()
+        for i, geom in enumerate(geometries):
+            indexed = QgsFeature(i)
+            indexed.setGeometry(geom)
+            index.addFeature(indexed)
+        
+        rows = []
+        cols = []
+        for i, geom in enumerate(geometries):
+            for j in index.intersects(geom.boundingBox()):
+                if j <= i or not geom.intersects(geometries[j]):
+                    continue
+                shared = geom.intersection(geometries[j])
+                # Fronteira comum (linha) ou pequena sobreposição entre polígonos
+                if shared.length() > 0 or shared.type() == QgsWkbTypes.PolygonGeometry:
+                    rows.extend([i, j])
+                    cols.extend([j, i])
+        
+        return rows, cols
+    
     def prepare_data_by_type(self, values):
         """Prepara os dados baseado no tipo especificado (contagem vs contínuo)"""
         data_type = self.params['data_type']
         
+        # As transformações evitam arrays temporários: numexpr (quando
+        # disponível) avalia a expressão inteira em uma passada; sem ele,
+        # as operações NumPy escrevem no próprio array de saída
         if "Contagem" in data_type:
             # Para dados de contagem, aplicar transformação estabilizadora de variância
             # Usando transformação de Freeman-Tukey para dados de Poisson
-            processed = np.sqrt(values) + np.sqrt(values + 1)
+            if NUMEXPR_AVAILABLE:
+                processed = ne.evaluate('sqrt(v) + sqrt(v + 1)', local_dict={'v': values})
+            else:
+                processed = np.sqrt(values)
+                tmp = values + 1
+                np.sqrt(tmp, out=tmp)
+                processed += tmp
         elif "Taxa" in data_type:
             # Para taxas/proporções, usar transformação logit ou arcsin
             # Aqui usamos arcsin para proporções
-            processed = np.arcsin(np.sqrt(np.clip(values, 0, 1)))
+            if NUMEXPR_AVAILABLE:
+                processed = ne.evaluate('arcsin(sqrt(where(v < 0, 0, where(v > 1, 1, v))))',
+                                        local_dict={'v': values})
+            else:
+                processed = np.clip(values, 0, 1)
+                np.sqrt(processed, out=processed)
+                np.arcsin(processed, out=processed)
         else:
             # Para dados contínuos, usar os valores originais
             processed = values.copy()
         
         return processed
     
-    def calculate_advanced_moran_i(self, values, W):
-        """Calcula I de Moran com testes de permutação para dados de contagem"""
-        n = len(values)
+    def permutation_operands(self, y, W):
+        """
+        Retorna y centralizado e W usados apenas nos produtos das permutações:
+        em float32 acima de FLOAT32_THRESHOLD observações, senão inalterados.
+        """
+        if len(y) > self.FLOAT32_THRESHOLD:
+            return y.astype(np.float32), W.astype(np.float32)
+        return y, W
+    
+    def permuted_lag_blocks(self, y, W, seed):
+        """
+        Gera, em blocos, os valores permutados Y e suas defasagens W·Y.
+        
+        Com até _MAX_WORKERS blocos em cálculo e mais um em uso pelo
+        consumidor, cada bloco tem até PERMUTATION_BLOCK // ((_MAX_WORKERS + 1) · n)
+        permutações, de modo que a memória não cresce com o número total de
+        permutações nem com o número de threads. Cada bloco tem seu próprio
+        gerador aleatório derivado da semente; como a divisão em blocos não
+        depende da máquina nem do uso do Numba, a mesma semente gera sempre
+        as mesmas permutações.
+        """
+        n = len(y)
+        permutations = self.params['permutations']
+        block = max(1, self.PERMUTATION_BLOCK // ((self._MAX_WORKERS + 1) * n))
+        
+        # O núcleo Numba já é paralelo e não deve ser chamado de várias threads
+        workers = 1 if NUMBA_AVAILABLE else min(self._MAX_WORKERS, os.cpu_count() or 1)
+        
+        starts = range(0, permutations, block)
+        block_seeds = np.random.SeedSequence(seed).spawn(len(starts))
+        
+        def compute_block(b):
+            rng = np.random.default_rng(block_seeds[b])
+            perm_idx = permutation_indices(rng, min(block, permutations - starts[b]), n)
+            Y_perm = y[perm_idx]
+            if NUMBA_AVAILABLE:
+                WY = _permuted_lags_kernel(y, W.indptr, W.indices, W.data, perm_idx)
+            else:
+                WY = (W @ Y_perm.T).T
+            return Y_perm, WY
         
-        # Centralizar os valores
-        y = values - np.mean(values)
+        return self._iterate_blocks(compute_block, len(starts), workers)
+    
+    def conditional_lag_blocks(self, y, W, seed):
+        """
+        Gera, em blocos, as defasagens da randomização condicional do LISA.
+        
+        Para cada observação i, mantém y[i] fixo e sorteia os valores dos seus
+        kᵢ vizinhos entre as n - 1 demais observações. Como no PySAL, cada
+        permutação sorteia apenas k_max = max kᵢ índices ('rids'), reaproveitados
+        por todas as observações: o índice sorteado é deslocado em uma posição
+        quando alcança i, excluindo a própria observação.
+        
+        Retorna, por bloco, a matriz (permutações × n) das defasagens.
+        """
+        n = len(y)
+        permutations = self.params['permutations']
+        counts = np.diff(W.indptr)
+        k_max = int(counts.max())
+        
+        # Para cada peso da matriz CSR: sua linha (observação i) e sua posição
+        # entre os vizinhos de i, que seleciona a coluna de 'rids'
+        rows = np.repeat(np.arange(n), counts)
+        slots = np.arange(W.nnz) - np.repeat(W.indptr[:-1], counts)
+        has_neighbors = counts > 0
+        row_starts = W.indptr[:-1][has_neighbors]
+        
+        # Permutações divididas em ao menos _MAX_WORKERS blocos, para que
+        # mesmo problemas pequenos usem todos os núcleos; com até
+        # _MAX_WORKERS + 1 blocos em memória (ver _iterate_blocks), o total
+        # fica dentro de PERMUTATION_BLOCK. A divisão não depende da máquina:
+        # a mesma semente gera sempre as mesmas permutações
+        block = max(1, min(self.PERMUTATION_BLOCK // ((self._MAX_WORKERS + 1) * max(W.nnz, n)),
+                           -(-permutations // self._MAX_WORKERS)))
+        workers = min(self._MAX_WORKERS, os.cpu_count() or 1)
+        starts = range(0, permutations, block)
+        block_seeds = np.random.SeedSequence(seed).spawn(len(starts))
+        
+        def compute_block(b):
+            rng = np.random.default_rng(block_seeds[b])
+            rids = conditional_neighbor_ids(rng, min(block, permutations - starts[b]), n, k_max)
+            neighbor_ids = rids[:, slots]
+            neighbor_ids += neighbor_ids >= rows
+            WY = np.zeros((len(rids), n), dtype=y.dtype)
+            WY[:, has_neighbors] = np.add.reduceat(W.data * y[neighbor_ids], row_starts, axis=1)
+            return WY
+        
+        return self._iterate_blocks(compute_block, len(starts), workers)
+    
+    @staticmethod
+    def _iterate_blocks(compute_block, n_blocks, workers):
+        """
+        Calcula os blocos de permutações e os entrega em ordem.
+        
+        Com vários blocos, eles são calculados em threads: as operações
+        vetoriais liberam o GIL. No máximo 'workers' blocos ficam em
+        andamento, além do último entregue ao consumidor: quem escolhe o
+        tamanho do bloco divide PERMUTATION_BLOCK por _MAX_WORKERS + 1.
+        """
+        if n_blocks == 1 or workers == 1:
+            for b in range(n_blocks):
+                yield compute_block(b)
+            return
         
-        # Calcular I de Moran observado
-        numerator = 0
-        denominator = np.sum(y**2)
-        S0 = np.sum(W)  # Soma de todos os pesos
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for b in range(n_blocks):
+                pending.append(executor.submit(compute_block, b))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    def calculate_advanced_moran_i(self, y, m2, W, seed=None):
+        """
+        Calcula I de Moran com testes de permutação para dados de contagem.
+        
+        Recebe os valores já centralizados (y) e sua soma de quadrados (m2).
+        """
+        n = len(y)
         
-        for i in range(n):
-            for j in range(n):
-                numerator += W[i,j] * y[i] * y[j]
+        # Calcular I de Moran observado
+        # Numerador Σᵢ Σⱼ wᵢⱼ yᵢ yⱼ como produto matricial (BLAS), sem laço duplo
+        denominator = m2
+        S0 = W.sum()  # Soma de todos os pesos
+        numerator = y @ (W @ y)
         
         I_observed = (n / S0) * (numerator / denominator)
         
         # Valor esperado
         E_I = -1 / (n - 1)
         
-        # Teste de permutação simplificado (menos permutações para rapidez)
-        permutations = min(self.params['permutations'], 199)  # Limitar para performance
-        I_permuted = []
-        valid_permutations = 0
-        
-        for perm_i in range(permutations):
-            try:
-                # Permutação aleatória dos valores
-                y_perm = np.random.permutation(y)
-                
-                # Calcular I para a permutação
-                num_perm = 0
-                for i in range(n):
-                    for j in range(n):
-                        num_perm += W[i,j] * y_perm[i] * y_perm[j]
-                
-                I_perm = (n / S0) * (num_perm / denominator)
-                
-                # Verificar se o resultado é válido
-                if np.isfinite(I_perm):
-                    I_permuted.append(I_perm)
-                    valid_permutations += 1
-                    
-            except Exception:
-                continue
-        
-        if valid_permutations < permutations * 0.5:
-            raise Exception(f"Muitas permutações falharam ({permutations - valid_permutations} de {permutations}). "
-                          "Isso pode indicar problemas com os dados.")
-        
-        I_permuted = np.array(I_permuted)
-        
-        # Calcular p-valor baseado nas permutações válidas
-        if I_observed >= E_I:
-            p_value = np.sum(I_permuted >= I_observed) / valid_permutations
+        # Teste de permutação com todas as permutações solicitadas, calculadas
+        # em blocos de matrizes (permutações × n) com um produto por bloco
+        permutations = self.params['permutations']
+        # Entradas validadas em run_analysis: todos os resultados são finitos
+        I_permuted = np.concatenate([
+            (n / S0) * ((Y_perm * WY).sum(axis=1) / denominator)
+            for Y_perm, WY in self.permuted_lag_blocks(*self.permutation_operands(y, W), seed)
+        ])
+        
+        # P-valor bilateral conservador: (1 + k) / (1 + M), em que k conta as
+        # permutações que se afastam da média ao menos tanto quanto a observada
+        perm_mean = I_permuted.mean()
+        extremes = np.sum(np.abs(I_permuted - perm_mean) >= abs(I_observed - perm_mean))
+        p_value = (1 + extremes) / (1 + permutations)
+        
+        if "Contínuo" in self.params['data_type']:
+            # Dados gaussianos: variância analítica de Cliff-Ord (hipótese de
+            # normalidade); o p-valor continua vindo das permutações
+            var_I = _moran_variance_analytic(W, n)
         else:
-            p_value = np.sum(I_permuted <= I_observed) / valid_permutations
-        
-        # P-valor bilateral
-        p_value = min(2 * p_value, 1.0)
-        
-        # Variância empírica das permutações
-        var_I = np.var(I_permuted) if len(I_permuted) > 1 else 0
+            # Variância empírica das permutações
+            var_I = np.var(I_permuted) if len(I_permuted) > 1 else 0
         z_score = (I_observed - E_I) / np.sqrt(var_I) if var_I > 0 else 0
         
+        # Resultados reportados como float do Python
         return {
-            'I': I_observed,
+            'I': float(I_observed),
             'E_I': E_I,
-            'Var_I': var_I,
-            'z_score': z_score,
-            'p_value': p_value,
-            'permutations': valid_permutations,
-            'total_attempted': permutations,
+            'Var_I': float(var_I),
+            'z_score': float(z_score),
+            'p_value': float(p_value),
+            'permutations': permutations,
             'significance_level': self.params['significance_level']
         }
     
-    def calculate_advanced_lisa(self, values, W):
-        """Calcula indicadores LISA com classificação de padrões"""
-        n = len(values)
-        y = values - np.mean(values)
-        
-        # Calcular estatísticas LISA para cada observação
-        lisa_values = []
-        z_scores = []
-        p_values = []
-        spatial_patterns = []
+    def calculate_advanced_lisa(self, values, y, W, seed=None):
+        """
+        Calcula indicadores LISA com classificação de padrões.
         
-        # Usar menos permutações para LISA para melhor performance
-        permutations = min(self.params['permutations'] // 2, 99)
+        Recebe os valores processados e sua versão centralizada (y).
+        """
+        n = len(values)
         
-        for i in range(n):
-            # LISA local observado
-            lisa_i_obs = y[i] * np.sum(W[i] * y)
-            lisa_values.append(lisa_i_obs)
-            
-            # Teste de permutação local simplificado
-            lisa_i_perm = []
-            valid_local_perms = 0
-            
-            for perm_j in range(permutations):
-                try:
-                    y_perm = np.random.permutation(y)
-                    lisa_i = y[i] * np.sum(W[i] * y_perm)
-                    
-                    if np.isfinite(lisa_i):
-                        lisa_i_perm.append(lisa_i)
-                        valid_local_perms += 1
-                        
-                except Exception:
-                    continue
-            
-            if valid_local_perms == 0:
-                # Se nenhuma permutação for válida, usar valores padrão
-                p_val = 1.0
-                z_i = 0.0
-            else:
-                lisa_i_perm = np.array(lisa_i_perm)
-                
-                # P-valor baseado em permutações
-                if lisa_i_obs >= 0:
-                    p_val = np.sum(lisa_i_perm >= lisa_i_obs) / valid_local_perms
-                else:
-                    p_val = np.sum(lisa_i_perm <= lisa_i_obs) / valid_local_perms
-                
-                p_val = min(2 * p_val, 1.0)  # P-valor bilateral
-                
-                # Z-score baseado na distribuição das permutações
-                var_perm = np.var(lisa_i_perm) if len(lisa_i_perm) > 1 else 0
-                z_i = (lisa_i_obs - np.mean(lisa_i_perm)) / np.sqrt(var_perm) if var_perm > 0 else 0
-            
-            p_values.append(p_val)
-            z_scores.append(z_i)
-            
-            # Classificar padrão espacial
-            original_value = values[i]
-            mean_value = np.mean(values)
-            neighbors_mean = np.sum(W[i] * values) if np.sum(W[i]) > 0 else mean_value
-            
-            if p_val <= self.params['significance_level']:
-                if original_value > mean_value and neighbors_mean > mean_value:
-                    pattern = "High-High"
-                elif original_value < mean_value and neighbors_mean < mean_value:
-                    pattern = "Low-Low"
-                elif original_value > mean_value and neighbors_mean < mean_value:
-                    pattern = "High-Low"
-                elif original_value < mean_value and neighbors_mean > mean_value:
-                    pattern = "Low-High"
-                else:
-                    pattern = "Não significativo"
-            else:
-                pattern = "Não significativo"
-            
-            spatial_patterns.append(pattern)
+        permutations = self.params['permutations']
+        alpha = self.params['significance_level']
+        
+        # Matriz de pesos em CSR: os núcleos percorrem apenas os kᵢ vizinhos
+        # de cada linha (indptr/indices/data), sem cópia se já estiver em CSR
+        W = W.tocsr()
+        
+        # Defasagem espacial em um único produto esparso W @ y; a média dos
+        # vizinhos nos valores originais é obtida dela, sem um segundo produto
+        lag_y = W @ y
+        row_sums = np.asarray(W.sum(axis=1)).ravel()
+        mean_value = values.mean()
+        lag_values = lag_y + (mean_value - y.mean()) * row_sums
+        
+        # Média dos vizinhos de todas as observações; sem vizinhos, a média global
+        neighbors_mean_all = np.where(row_sums > 0, lag_values, mean_value)
+        
+        # LISA local observado para todas as observações
+        lisa_values = y * lag_y
+        
+        # Média da defasagem sob a randomização condicional:
+        # E[(W·y)ᵢ] = wᵢ. · (Σⱼ yⱼ - yᵢ) / (n - 1). Conhecida de antemão, permite
+        # o teste bilateral (desvio em relação à média) em uma única passada
+        lag_center = row_sums * (y.sum() - y) / (n - 1)
+        
+        # Teste de permutação condicional para todas as observações, bloco a
+        # bloco, com defasagens de vizinhos sorteados entre as demais
+        # observações. Como Iᵢ = yᵢ · (W·y)ᵢ e yᵢ é constante entre as
+        # permutações, o teste e o z-score usam apenas as defasagens: yᵢ só
+        # multiplica o valor observado (e inverte o sinal do z-score se negativo).
+        # Acumulam-se contagens e momentos, sem guardar todas as permutações.
+        y_perm, W_perm = self.permutation_operands(y, W)
+        if NUMBA_AVAILABLE:
+            extremes, lag_sum, lag_sumsq = _lisa_perm_kernel(
+                y_perm, W_perm.indptr, W_perm.indices, W_perm.data, lag_y, lag_center,
+                permutations, 0 if seed is None else seed)
+        else:
+            observed = np.abs(lag_y - lag_center)
+            extremes = np.zeros(n)
+            lag_sum = np.zeros(n)
+            lag_sumsq = np.zeros(n)
+            for WY in self.conditional_lag_blocks(y_perm, W_perm, seed):
+                extremes += np.sum(np.abs(WY - lag_center) >= observed, axis=0)
+                lag_sum += WY.sum(axis=0)
+                lag_sumsq += np.square(WY, dtype=np.float64).sum(axis=0)
+        
+        # Com yᵢ = 0 todas as estatísticas permutadas são iguais à observada
+        extremes[y == 0] = permutations
+        
+        # P-valor bilateral conservador: (1 + k) / (1 + M), nunca zero
+        p_values = (1 + extremes) / (1 + permutations)
+        
+        # Z-score baseado na distribuição das permutações:
+        # (Iᵢ - média) / desvio = sinal(yᵢ) · ((W·y)ᵢ - média) / desvio das defasagens
+        lag_mean = lag_sum / permutations
+        lag_std = np.sqrt(np.maximum(lag_sumsq / permutations - lag_mean ** 2, 0.0))
+        z_scores = np.divide(np.sign(y) * (lag_y - lag_mean), lag_std,
+                             out=np.zeros(n), where=lag_std > 0)
+        
+        # Classificar padrões espaciais de todas as observações de uma vez;
+        # valores iguais à média (própria ou dos vizinhos) não são classificados
+        hi_val = values > mean_value
+        lo_val = values < mean_value
+        hi_nbr = neighbors_mean_all > mean_value
+        lo_nbr = neighbors_mean_all < mean_value
+        sig = p_values <= alpha
+        spatial_patterns = np.select(
+            [sig & hi_val & hi_nbr, sig & lo_val & lo_nbr, sig & hi_val & lo_nbr, sig & lo_val & hi_nbr],
+            ["High-High", "Low-Low", "High-Low", "Low-High"],
+            default="Não significativo").astype('<U20')
         
         # Debug: verificar resultados gerados
         safe_log_message(f"LISA calculado para {len(lisa_values)} observações", "Spatial Analysis", "info")
-        safe_log_message(f"Padrões encontrados: {set(spatial_patterns)}", "Spatial Analysis", "info")
+        safe_log_message(f"Padrões encontrados: {set(np.unique(spatial_patterns).tolist())}", "Spatial Analysis", "info")
         
         # Contar padrões significativos
-        significant_count = sum(1 for p in p_values if p <= self.params['significance_level'])
+        significant_count = int(np.count_nonzero(sig))
         safe_log_message(f"Padrões significativos: {significant_count} de {len(p_values)}", "Spatial Analysis", "info")
         
+        # Resultados em arrays float64 e padrões em array '<U20', o tamanho
+        # do campo Categoria_Visual
         return {
             'lisa_values': lisa_values,
             'z_scores': z_scores,
             'p_values': p_values,
             'spatial_patterns': spatial_patterns,
-            'significance_level': self.params['significance_level']
+            'significance_level': alpha
         }
     
     def create_lisa_layer(self, features, lisa_results):
         """Cria nova camada com resultados LISA detalhados"""
         original_layer = self.params['layer']
+        field_name = self.params['field_name']
         layer_name = f"{original_layer.name()}_LISA_Analise"
         
         safe_log_message(f"Criando camada LISA com {len(features)} features", "Spatial Analysis", "info")
@@ -810,12 +1220,15 @@ class SpatialAnalysisWorker:
         original_fields = original_layer.fields()
         essential_fields = []
         
-        # Adicionar campo ID e campo analisado
+        # Adicionar campo ID e campo analisado (conjuntos de nomes montados
+        # uma única vez, fora do laço)
+        kept_names = self.ID_FIELD_NAMES | {field_name.lower()}
         id_field_added = False
         for field in original_fields:
-            if field.name().lower() in ['id', 'fid', 'objectid', self.params['field_name'].lower()]:
+            name = field.name().lower()
+            if name in kept_names:
                 essential_fields.append(field)
-                if field.name().lower() in ['id', 'fid', 'objectid']:
+                if name in self.ID_FIELD_NAMES:
                     id_field_added = True
         
         # Se não há campo ID, criar um
@@ -842,11 +1255,27 @@ class SpatialAnalysisWorker:
         # Adicionar features com resultados
         new_features = []
         
-        for i, feature in enumerate(features):
-            if i >= len(lisa_results['lisa_values']):
-                safe_log_message(f"Aviso: Feature {i} não tem resultado LISA correspondente", "Spatial Analysis", "warning")
-                continue
-                
+        # Ordem dos atributos calculada uma única vez: a nova camada tem os
+        # campos essenciais seguidos dos campos LISA; para cada campo essencial,
+        # seu índice na camada original (-1 para o ID criado)
+        source_indices = [original_fields.indexOf(field.name()) for field in essential_fields]
+        significance_level = lisa_results['significance_level']
+        
+        # Resultados convertidos uma única vez em listas de objetos Python,
+        # em vez de um float()/str() por elemento de array dentro do laço
+        lisa_list = lisa_results['lisa_values'].tolist()
+        z_list = lisa_results['z_scores'].tolist()
+        p_list = lisa_results['p_values'].tolist()
+        pattern_list = lisa_results['spatial_patterns'].tolist()
+        
+        # Validar uma única vez a correspondência entre feições e resultados;
+        # feições excedentes (sem resultado LISA) não são copiadas
+        n_results = len(lisa_results['lisa_values'])
+        if len(features) > n_results:
+            safe_log_message(f"Aviso: {len(features) - n_results} features não têm resultado LISA correspondente",
+                             "Spatial Analysis", "warning")
+        
+        for i, feature in enumerate(features[:n_results]):
             new_feature = QgsFeature(new_layer.fields())
             
             # Copiar geometria
@@ -857,38 +1286,25 @@ class SpatialAnalysisWorker:
                 safe_log_message(f"Aviso: Feature {i} tem geometria inválida", "Spatial Analysis", "warning")
                 continue
             
-            # Copiar atributos essenciais
-            for field in essential_fields[:-6]:  # Excluir os campos LISA que serão adicionados separadamente
-                field_name = field.name()
-                if field_name in [f.name() for f in original_fields]:
-                    value = feature[field_name]
-                    new_feature[field_name] = value
+            # Atributos essenciais (ou ID sequencial) seguidos dos resultados
+            # LISA, atribuídos em uma única chamada
+            attributes = [feature[idx] if idx >= 0 else i + 1 for idx in source_indices]
             
-            # Adicionar ID se necessário
-            if not id_field_added:
-                new_feature["ID"] = i + 1
+            pattern = pattern_list[i]
+            if p_list[i] <= significance_level:
+                significant, visual_category = "Sim", pattern
+            else:
+                significant, visual_category = "Não", "Não significativo"
             
-            # Adicionar resultados LISA
-            try:
-                new_feature["LISA_I"] = float(lisa_results['lisa_values'][i])
-                new_feature["LISA_Z"] = float(lisa_results['z_scores'][i])
-                new_feature["LISA_P"] = float(lisa_results['p_values'][i])
-                new_feature["Padrao_Espacial"] = str(lisa_results['spatial_patterns'][i])
-                
-                # Classificar significância
-                p_val = lisa_results['p_values'][i]
-                significance_level = lisa_results['significance_level']
-                
-                if p_val <= significance_level:
-                    new_feature["Significativo"] = "Sim"
-                    new_feature["Categoria_Visual"] = str(lisa_results['spatial_patterns'][i])
-                else:
-                    new_feature["Significativo"] = "Não"
-                    new_feature["Categoria_Visual"] = "Não significativo"
-                    
-            except Exception as e:
-                safe_log_message(f"Erro ao processar feature {i}: {str(e)}", "Spatial Analysis", "warning")
-                continue
+            attributes += [
+                lisa_list[i],
+                z_list[i],
+                p_list[i],
+                pattern,
+                significant,
+                visual_category
+            ]
+            new_feature.setAttributes(attributes)
             
             new_features.append(new_feature)
         
@@ -950,7 +1366,7 @@ class SpatialAnalysisWorker:
         
         # Obter valores únicos do campo para verificar
         unique_values = layer.uniqueValues(field_index)
-        safe_log_message(f"Valores únicos encontrados: {list(unique_values)}", "Spatial Analysis", "info")
+        safe_log_message(f"Valores únicos encontrados: {unique_values}", "Spatial Analysis", "info")
         
         # Definir cores para cada tipo de padrão espacial
         pattern_colors = {
@@ -963,19 +1379,20 @@ class SpatialAnalysisWorker:
         
         # Criar categorias para o renderer
         categories = []
+        geometry_type = layer.geometryType()
         
         for pattern, color_hex in pattern_colors.items():
             if pattern in unique_values:  # Só criar categoria se o padrão existe nos dados
                 try:
                     # Criar símbolo baseado no tipo de geometria
-                    if layer.geometryType() == QgsWkbTypes.PolygonGeometry:
+                    if geometry_type == QgsWkbTypes.PolygonGeometry:
                         symbol = QgsFillSymbol.createSimple({
                             'color': color_hex,
                             'outline_color': 'black',
                             'outline_width': '0.3',
                             'outline_style': 'solid'
                         })
-                    elif layer.geometryType() == QgsWkbTypes.PointGeometry:
+                    elif geometry_type == QgsWkbTypes.PointGeometry:
                         symbol = QgsMarkerSymbol.createSimple({
                             'color': color_hex,
                             'outline_color': 'black',
@@ -983,7 +1400,7 @@ class SpatialAnalysisWorker:
                             'size': '3'
                         })
                     else:  # LineGeometry
-                        symbol = QgsSymbol.defaultSymbol(layer.geometryType())
+                        symbol = QgsSymbol.defaultSymbol(geometry_type)
                         symbol.setColor(QColor(color_hex))
                     
                     category = QgsRendererCategory(pattern, symbol, pattern)
@@ -1040,14 +1457,26 @@ class SpatialAnalysisWorker:
                 file_path = os.path.join(temp_dir, file_name)
                 counter += 1
             
-            # Salvar como Shapefile
-            error = QgsVectorFileWriter.writeAsVectorFormat(
-                layer,
-                file_path,
-                "utf-8",
-                layer.crs(),
-                "ESRI Shapefile"
-            )
+            # Salvar como Shapefile: writeAsVectorFormatV3 (QGIS >= 3.20), com
+            # fallback para a API antiga nas versões anteriores
+            if hasattr(QgsVectorFileWriter, 'writeAsVectorFormatV3'):
+                options = QgsVectorFileWriter.SaveVectorOptions()
+                options.driverName = "ESRI Shapefile"
+                options.fileEncoding = "utf-8"
+                error = QgsVectorFileWriter.writeAsVectorFormatV3(
+                    layer,
+                    file_path,
+                    QgsProject.instance().transformContext(),
+                    options
+                )[0]
+            else:
+                error = QgsVectorFileWriter.writeAsVectorFormat(
+                    layer,
+                    file_path,
+                    "utf-8",
+                    layer.crs(),
+                    "ESRI Shapefile"
+                )
             
             if error == QgsVectorFileWriter.NoError:
                 safe_log_message(f"Arquivo salvo com sucesso: {file_path}", "Spatial Analysis", "info")
@@ -1099,20 +1528,21 @@ class AdvancedResultsDialog(QDialog):
     
     def generate_detailed_results(self):
         """Gera relatório HTML detalhado dos resultados"""
-        html = "<html><body style='font-family: Arial, sans-serif;'>"
-        html += "<h2 style='color: #2E5984;'>Relatório de Análise de Autocorrelação Espacial</h2>"
+        # Partes do relatório acumuladas em lista e unidas ao final
+        parts = ["<html><body style='font-family: Arial, sans-serif;'>"]
+        parts.append("<h2 style='color: #2E5984;'>Relatório de Análise de Autocorrelação Espacial</h2>")
         
         if 'moran' in self.results:
             moran = self.results['moran']
-            html += "<h3 style='color: #4A90A4;'>I de Moran Global</h3>"
-            html += f"<p><strong>Estatística I de Moran:</strong> {moran['I']:.6f}</p>"
-            html += f"<p><strong>Valor Esperado (H₀):</strong> {moran['E_I']:.6f}</p>"
-            html += f"<p><strong>Z-score:</strong> {moran['z_score']:.4f}</p>"
-            html += f"<p><strong>P-valor:</strong> {moran['p_value']:.6f}</p>"
-            html += f"<p><strong>Teste baseado em:</strong> {moran['permutations']} permutações válidas</p>"
+            parts.append("<h3 style='color: #4A90A4;'>I de Moran Global</h3>")
+            parts.append(f"<p><strong>Estatística I de Moran:</strong> {moran['I']:.6f}</p>")
+            parts.append(f"<p><strong>Valor Esperado (H₀):</strong> {moran['E_I']:.6f}</p>")
+            parts.append(f"<p><strong>Z-score:</strong> {moran['z_score']:.4f}</p>")
+            parts.append(f"<p><strong>P-valor:</strong> {moran['p_value']:.6f}</p>")
+            parts.append(f"<p><strong>Teste baseado em:</strong> {moran['permutations']} permutações (todas utilizadas)</p>")
             
             # Interpretação estatística
-            html += "<h4>Interpretação:</h4>"
+            parts.append("<h4>Interpretação:</h4>")
             significance_level = moran['significance_level']
             
             if moran['p_value'] < significance_level:
@@ -1126,21 +1556,19 @@ class AdvancedResultsDialog(QDialog):
                 interpretation = f"<span style='color: gray;'><strong>Distribuição espacial aleatória</strong></span> (α = {significance_level})"
                 explanation = "Não há evidência de padrão espacial significativo nos dados."
             
-            html += f"<p>{interpretation}</p>"
-            html += f"<p><em>{explanation}</em></p>"
+            parts.append(f"<p>{interpretation}</p>")
+            parts.append(f"<p><em>{explanation}</em></p>")
         
         if 'lisa' in self.results:
             lisa = self.results['lisa']
-            html += "<h3 style='color: #4A90A4;'>Análise LISA (Indicadores Locais)</h3>"
+            parts.append("<h3 style='color: #4A90A4;'>Análise LISA (Indicadores Locais)</h3>")
             
             # Resumo dos padrões encontrados
             patterns = lisa['spatial_patterns']
-            pattern_counts = {}
-            for pattern in patterns:
-                pattern_counts[pattern] = pattern_counts.get(pattern, 0) + 1
+            pattern_counts = dict(zip(*np.unique(patterns, return_counts=True)))
             
-            html += "<h4>Resumo dos Padrões Espaciais Locais:</h4>"
-            html += "<ul>"
+            parts.append("<h4>Resumo dos Padrões Espaciais Locais:</h4>")
+            parts.append("<ul>")
             
             total_obs = len(patterns)
             for pattern, count in pattern_counts.items():
@@ -1156,43 +1584,48 @@ class AdvancedResultsDialog(QDialog):
                 else:
                     description = "Sem padrão espacial significativo"
                 
-                html += f"<li><strong>{pattern}:</strong> {count} observações ({percentage:.1f}%) - {description}</li>"
+                parts.append(f"<li><strong>{pattern}:</strong> {count} observações ({percentage:.1f}%) - {description}</li>")
             
-            html += "</ul>"
+            parts.append("</ul>")
             
             # Informações sobre significância
-            significant_count = sum(1 for p in lisa['p_values'] if p <= lisa['significance_level'])
+            significant_count = int(np.sum(lisa['p_values'] <= lisa['significance_level']))
             significance_percentage = (significant_count / total_obs) * 100
             
-            html += f"<p><strong>Observações com padrão espacial significativo:</strong> {significant_count} de {total_obs} ({significance_percentage:.1f}%)</p>"
-            html += f"<p><strong>Nível de significância utilizado:</strong> α = {lisa['significance_level']}</p>"
+            parts.append(f"<p><strong>Observações com padrão espacial significativo:</strong> {significant_count} de {total_obs} ({significance_percentage:.1f}%)</p>")
+            parts.append(f"<p><strong>Nível de significância utilizado:</strong> α = {lisa['significance_level']}</p>")
             
             if 'lisa_layer' in self.results:
                 layer_name = self.results['lisa_layer'].name()
-                html += f"<p><strong>Camada criada:</strong> {layer_name}</p>"
+                parts.append(f"<p><strong>Camada criada:</strong> {layer_name}</p>")
                 
                 if 'saved_file' in self.results:
-                    html += f"<p><strong>Arquivo salvo em:</strong> <code>{self.results['saved_file']}</code></p>"
-                    html += "<p><em>O arquivo foi salvo permanentemente e pode ser usado em outros projetos.</em></p>"
+                    parts.append(f"<p><strong>Arquivo salvo em:</strong> <code>{self.results['saved_file']}</code></p>")
+                    parts.append("<p><em>O arquivo foi salvo permanentemente e pode ser usado em outros projetos.</em></p>")
                 else:
-                    html += "<p><em>Os resultados foram adicionados como uma camada temporária no projeto atual.</em></p>"
+                    parts.append("<p><em>Os resultados foram adicionados como uma camada temporária no projeto atual.</em></p>")
                     
-                html += "<p><em>A camada possui simbolização automática baseada nos padrões detectados.</em></p>"
+                parts.append("<p><em>A camada possui simbolização automática baseada nos padrões detectados.</em></p>")
         
         # Informações metodológicas
-        html += "<hr>"
-        html += "<h3 style='color: #4A90A4;'>Informações Metodológicas</h3>"
-        html += "<p><strong>Método de análise:</strong> Autocorrelação espacial com testes de permutação</p>"
-        html += "<p><strong>Vantagens do método:</strong></p>"
-        html += "<ul>"
-        html += "<li>Testes de significância robustos sem assumir normalidade</li>"
-        html += "<li>Adequado para dados de contagem e distribuições não-normais</li>"
-        html += "<li>Identificação de padrões locais e globais</li>"
-        html += "<li>Visualização automática dos resultados</li>"
-        html += "</ul>"
-        
-        html += "</body></html>"
-        return html
+        parts.append("<hr>")
+        parts.append("<h3 style='color: #4A90A4;'>Informações Metodológicas</h3>")
+        parts.append("<p><strong>Método de análise:</strong> Autocorrelação espacial com testes de permutação</p>")
+        if 'perm_seed' in self.results:
+            backend = self.results.get('perm_backend', "NumPy")
+            parts.append(f"<p><strong>Semente das permutações:</strong> {self.results['perm_seed']} "
+                         f"(reprodutível com o backend {backend}; os resultados LISA "
+                         f"diferem entre os backends Numba e NumPy)</p>")
+        parts.append("<p><strong>Vantagens do método:</strong></p>")
+        parts.append("<ul>")
+        parts.append("<li>Testes de significância robustos sem assumir normalidade</li>")
+        parts.append("<li>Adequado para dados de contagem e distribuições não-normais</li>")
+        parts.append("<li>Identificação de padrões locais e globais</li>")
+        parts.append("<li>Visualização automática dos resultados</li>")
+        parts.append("</ul>")
+        
+        parts.append("</body></html>")
+        return "".join(parts)
 
 
 # Função para inicializar o plugin